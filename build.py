@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+"""Content-hashed incremental build of AERMOD post-processing jobs.
+
+A job spec (a dictionary, or a JSON file of one) lists the input files and the
+figures and exports made from them:
+
+{"directory" : "../data"
+,"cache"     : ".aermodpy-build"
+,"inputs"    : {"no2": {"file": "SUNYESF_1HR_NO2.GRF", "vars": "grf", "ranked": 1
+                       ,"annual": false, "building_file": "SUNYESF_final.PIP"}}
+,"targets"   : [{"input": "no2", "stage": "gridplot", "keys": null
+                ,"filename": "out/SUNYESF_NO2_{key}_withbg.png"
+                ,"options": {"colorslevels": "1h-no2", "add_background": 49.6, ...}}
+               ,{"input": "no2", "stage": "exportdata", "filename": "out/SUNYESF_NO2.npz"
+                ,"fileformat": "npz"}
+               ]
+}
+
+keys is a list of [r_type, r_form, source_group], or null for every datatype
+in the file. filename may use {key}, {r_type}, {r_form} and {source_group};
+for exportpyramid it names the pyramid directory.
+colorslevels may name a support.color_dicts entry.
+
+Each target is built through the stages
+
+    parse -> rank -> interpolate -> gridplot or exportpyramid
+    parse -> exportdata
+
+and each stage is identified by a hash of its inputs and options: the content
+of the input files, the parse options, the plotdata selection (rank, scalar,
+background, flagpoles), the interpolation method and the plot options. Stage
+results are stored in the cache directory between runs, and an output is only
+rebuilt when the hash it was last built from changes. Input files are only
+rehashed when their size or modification time changes.
+
+developed for python 3.x
+"""
+
+# standard library imports
+import os
+import json
+import hashlib
+import numpy
+
+# internal package imports
+from aermodpy.aermod import post, point, __version__
+from aermodpy.support import color_dicts, vars_indices
+
+# gridplot kwargs that select the plotted concentrations (see post.plotdata)
+selection_options = ("exclude_flagpole_receptors", "ranked_data", "annual", "scalar", "add_background")
+
+def stagehash(*parts):
+    """hash of the JSON form of a stage's inputs and options"""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class builder:
+    "incremental runner for a post-processing job spec"
+
+    verbose = False
+
+    def __init__(self
+                ,spec
+                ,verbose=True
+                ):
+        """
+        mandatory arguments:
+        spec - job spec dictionary, or the path of a JSON job spec
+        """
+        if isinstance(spec, str):
+            with open(spec) as specfile:
+                spec = json.load(specfile)
+        self.spec = spec
+        self.directory = spec.get("directory", ".")
+        self.cache = spec.get("cache", ".aermodpy-build")
+        self.verbose = verbose
+
+        self.manifestfile = os.path.join(self.cache, "manifest.json")
+        try:
+            with open(self.manifestfile) as manifestfile:
+                self.manifest = json.load(manifestfile)
+        except (IOError, ValueError):
+            self.manifest = {}
+        self.manifest.setdefault("files", {})   # path: [size, mtime_ns, sha1]
+        self.manifest.setdefault("outputs", {}) # path: hash of the stage that built it
+
+        self.posts = {}   # parse hash: loaded post object
+        self.used = set() # cache files read or written this run
+
+    def save_manifest(self):
+        os.makedirs(self.cache, exist_ok=True)
+        with open(self.manifestfile, "w") as manifestfile:
+            json.dump(self.manifest, manifestfile, indent=1, sort_keys=True)
+
+    def filehash(self
+                ,filename
+                ):
+        """content hash of an input file, reused while its size and modification time are unchanged"""
+        path = os.path.abspath(os.path.join(self.directory, filename))
+        stat = os.stat(path)
+        size, mtime_ns, digest = self.manifest["files"].get(path, (None, None, None))
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            if self.verbose: print("--> hashing", path)
+            sha1 = hashlib.sha1()
+            with open(path, "rb") as inputfile:
+                for chunk in iter(lambda: inputfile.read(2**20), b""):
+                    sha1.update(chunk)
+            digest = sha1.hexdigest()
+            self.manifest["files"][path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def artifact(self
+                ,stage
+                ,digest
+                ):
+        """cache file of a stage result"""
+        path = os.path.join(self.cache, "%s-%s.npz" % (stage, digest))
+        self.used.add(os.path.abspath(path))
+        return path
+
+    def input(self
+             ,name
+             ):
+        """input spec with its parse defaults"""
+        spec = dict(self.spec["inputs"][name])
+        spec.setdefault("vars", "post")
+        spec.setdefault("ranked", 1)
+        spec.setdefault("annual", False)
+        spec.setdefault("building_file", None)
+        return spec
+
+    # parse stage
+
+    def parsehash(self
+                 ,name
+                 ):
+        spec = self.input(name)
+        return stagehash("parse", __version__, self.filehash(spec["file"])
+                        ,spec["vars"], spec["ranked"], spec["annual"]
+                        )
+
+    def parsed(self
+              ,name
+              ):
+        """post object of an input, loaded from the cache or parsed"""
+        digest = self.parsehash(name)
+        if digest in self.posts:
+            return self.posts[digest]
+
+        spec = self.input(name)
+        path = self.artifact("parse", digest)
+        if os.path.exists(path):
+            if self.verbose: print("--> loading parsed", spec["file"])
+            p = post(None, verbose=False)
+            p.loadresults(path)
+        else:
+            if self.verbose: print("--> parsing", spec["file"])
+            p = post(spec["file"]
+                    ,directory=self.directory
+                    ,vars_index=vars_indices[spec["vars"]]
+                    ,verbose=False
+                    )
+            p.processPOSTData(ranked=spec["ranked"], annual=spec["annual"])
+            os.makedirs(self.cache, exist_ok=True)
+            p.saveresults(path)
+        if spec["building_file"]:
+            p.add_buildings(spec["building_file"], directory=self.directory)
+        self.posts[digest] = p
+        return p
+
+    def datatypes(self
+                 ,name
+                 ):
+        """datatype keys of an input, read from the cached parse without loading its arrays"""
+        path = self.artifact("parse", self.parsehash(name))
+        if os.path.exists(path):
+            with numpy.load(path) as archive:
+                return [tuple(key.split("|")) for key in archive["datatypes"].tolist()]
+        return self.parsed(name).datatypes
+
+    # rank and interpolate stages
+
+    def rankhash(self
+                ,name
+                ,key
+                ,options
+                ):
+        return stagehash("rank", self.parsehash(name), key
+                        ,{option: options[option] for option in selection_options if option in options}
+                        )
+
+    def ranked(self
+              ,name
+              ,key
+              ,options
+              ):
+        """receptors and concentrations plotted for a datatype, see post.plotdata"""
+        path = self.artifact("rank", self.rankhash(name, key, options))
+        if os.path.exists(path):
+            with numpy.load(path) as archive:
+                return point(len(archive["X"]), Xs=archive["X"], Ys=archive["Y"], Zs=archive["Z"]), archive["concs"]
+        receptors, concs = self.parsed(name).plotdata(*key, **options)
+        numpy.savez(path, X=receptors.X, Y=receptors.Y, Z=receptors.Z, concs=concs)
+        return receptors, concs
+
+    def interpolatehash(self
+                       ,name
+                       ,key
+                       ,options
+                       ):
+        return stagehash("interpolate", self.rankhash(name, key, options)
+                        ,options.get("interpolation_method", "linear")
+                        )
+
+    def interpolated(self
+                    ,name
+                    ,key
+                    ,options
+                    ):
+        """interpolated grid for a datatype, see post.interpolate"""
+        path = self.artifact("interpolate", self.interpolatehash(name, key, options))
+        if os.path.exists(path):
+            with numpy.load(path) as archive:
+                return archive["xi"], archive["yi"], numpy.ma.masked_invalid(archive["zi"])
+        receptors, concs = self.ranked(name, key, options)
+        if self.verbose: print("--> interpolating", key)
+        xi, yi, zi = post(None, verbose=False).interpolate(receptors, concs, options.get("interpolation_method", "linear"))
+        numpy.savez(path, xi=xi, yi=yi, zi=zi.filled(numpy.nan))
+        return xi, yi, zi
+
+    # output stages
+
+    def options(self
+               ,target
+               ):
+        """gridplot kwargs of a target; colorslevels may name a support.color_dicts entry"""
+        options = dict(target.get("options", {}))
+        options.setdefault("annual", self.input(target["input"])["annual"])
+        return options
+
+    def render(self
+              ,target
+              ,key
+              ,filename
+              ):
+        """gridplot or exportpyramid of one datatype, reusing the cached interpolated grid"""
+        stage = target.get("stage", "gridplot")
+        options = self.options(target)
+        building_file = self.input(target["input"])["building_file"]
+        digest = stagehash(stage, self.interpolatehash(target["input"], key, options)
+                          ,self.filehash(building_file) if building_file else None
+                          ,options
+                          )
+        if not self.stale(filename, digest):
+            return False
+
+        grid = self.interpolated(target["input"], key, options)
+        p = self.parsed(target["input"])
+        if isinstance(options.get("colorslevels"), str):
+            options["colorslevels"] = color_dicts[options["colorslevels"]]
+        receptors, concs = p.plotdata(*key, **options)
+        p.cachegrid(receptors, concs, grid, options.get("interpolation_method", "linear"))
+        if self.verbose: print("--> rendering", filename)
+        if stage == "exportpyramid":
+            p.exportpyramid(*key, filename, options.pop("colorslevels"), **options)
+        else:
+            p.gridplot(*key, filename=filename, **options)
+        self.built(filename, digest)
+        return True
+
+    def exportdata(self
+                  ,target
+                  ,keys
+                  ,filename
+                  ):
+        """write the result fields of an input, see post.exportdata"""
+        fileformat = target.get("fileformat", "csv")
+        digest = stagehash("exportdata", self.parsehash(target["input"]), keys, fileformat)
+        if not self.stale(filename, digest):
+            return False
+
+        if self.verbose: print("--> exporting", filename)
+        directory, basename = os.path.split(filename)
+        self.parsed(target["input"]).exportdata(basename
+                                                ,directory=directory or "."
+                                                ,keys=keys
+                                                ,fileformat=fileformat
+                                                )
+        self.built(filename, digest)
+        return True
+
+    def stale(self
+             ,filename
+             ,digest
+             ):
+        """True if an output is missing or was built from a different stage hash"""
+        return (self.manifest["outputs"].get(os.path.abspath(filename)) != digest) \
+               or not os.path.exists(filename)
+
+    def built(self
+             ,filename
+             ,digest
+             ):
+        self.manifest["outputs"][os.path.abspath(filename)] = digest
+        self.save_manifest()
+
+    def run(self):
+        """build every stale target
+
+        returns a dictionary of output filename: True if built this run, False if up to date
+        """
+        os.makedirs(self.cache, exist_ok=True)
+        results = {}
+        for target in self.spec["targets"]:
+            keys = target.get("keys")
+            keys = [tuple(key) for key in keys] if keys else self.datatypes(target["input"])
+            if target.get("stage", "gridplot") == "exportdata":
+                results[target["filename"]] = self.exportdata(target, keys, target["filename"])
+                continue
+            for key in keys:
+                filename = target["filename"].format(key="_".join(key).replace(" ", "_")
+                                                    ,r_type=key[0]
+                                                    ,r_form=key[1]
+                                                    ,source_group=key[2]
+                                                    )
+                if os.path.dirname(filename):
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                results[filename] = self.render(target, key, filename)
+        self.save_manifest()
+        if self.verbose: print("--> %d of %d outputs rebuilt" % (sum(results.values()), len(results)))
+        return results
+
+    def clean(self):
+        """remove cache files not used by the last run"""
+        for entry in os.scandir(self.cache):
+            if entry.name.endswith(".npz") and (os.path.abspath(entry.path) not in self.used):
+                os.remove(entry.path)
+
+if __name__ == "__main__":
+
+    import sys
+    import matplotlib
+    matplotlib.use("Agg")
+
+    for spec in sys.argv[1:]:
+        builder(spec).run()
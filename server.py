@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""Local query and render server over parsed AERMOD results.
+
+Keeps parsed post objects, with their buildings and interpolated grids, in
+memory between requests, so replotting or querying a result does not reparse
+the POST file. Once their arrays and grids pass a memory cap, cached grids
+and then whole objects are evicted, least recently used first.
+
+requests (HTTP GET, parameters in the query string):
+/load    - parse a file: file, directory, vars, ranked, annual, building_file
+/query   - summary of one datatype: max, location and event date
+/field   - concentrations at every receptor, as JSON
+/grid    - interpolated grid as a .npy array
+/render  - gridplot PNG; other parameters are passed as gridplot kwargs
+/status  - loaded files and memory in use
+
+Every request other than /status names the file with the /load parameters,
+and the datatype with key=r_type|r_form|source_group (default: the first).
+
+developed for python 3.x
+"""
+
+# standard library imports
+import os
+import io
+import json
+import threading
+import collections
+import socketserver
+import urllib.parse
+import http.server
+import numpy
+
+# internal package imports
+from aermodpy.aermod import post
+from aermodpy.support import color_dicts, vars_indices
+
+def parsevalue(value):
+    """convert a query string value to bool, int, float or str"""
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            continue
+    return value
+
+class resultserver:
+    "in-memory cache of parsed post objects, with query and render methods"
+
+    verbose = False
+
+    def __init__(self
+                ,memory_cap=2*1024**3
+                ,directory="."
+                ,verbose=True
+                ):
+        """
+        optional arguments:
+        memory_cap - bytes of parsed arrays and grids kept before evicting the least recently used. default = 2 GiB
+        directory  - default directory of requested files. default = "."
+        """
+        self.memory_cap = memory_cap
+        self.directory = directory
+        self.verbose = verbose
+        self.posts = collections.OrderedDict()
+        self.lock = threading.RLock()
+        self.loading = collections.defaultdict(threading.Lock) # cache key: lock held while parsing
+        self.render_lock = threading.Lock() # pyplot is not thread safe
+
+    def footprint(self
+                 ,p
+                 ):
+        """bytes held by a post object: accumulators, receptors and cached grids"""
+        return p.memory_in_use() + 3 * p.receptors.X.nbytes + p.gridbytes()
+
+    def memory_in_use(self):
+        return sum(self.footprint(p) for p in self.posts.values())
+
+    def evict(self):
+        """bring memory in use under the cap, least recently used first: drop cached
+        grids (also of the only loaded file), then whole files other than the most recent"""
+        with self.lock:
+            for key, p in self.posts.items():
+                if self.memory_in_use() <= self.memory_cap:
+                    return
+                if p.gridbytes():
+                    if self.verbose: print("--> clearing grids of", key)
+                    p.cleargrids()
+            while (len(self.posts) > 1) and (self.memory_in_use() > self.memory_cap):
+                evicted, trash = self.posts.popitem(last=False)
+                if self.verbose: print("--> evicting", evicted)
+
+    def load(self
+            ,file
+            ,directory=None
+            ,vars="post"
+            ,ranked=1
+            ,annual=False
+            ,building_file=None
+            ,**ignored
+            ):
+        """parsed post object for a file, from the cache when already loaded"""
+        directory = directory or self.directory
+        if isinstance(annual, str):
+            annual = parsevalue(annual)
+        key = (os.path.abspath(os.path.join(directory, file)), vars, int(ranked), bool(annual), building_file)
+        with self.lock:
+            if key in self.posts:
+                self.posts.move_to_end(key)
+                return self.posts[key]
+            loading = self.loading[key]
+
+        # concurrent requests for the same file wait for one parse
+        with loading:
+            with self.lock:
+                if key in self.posts:
+                    self.posts.move_to_end(key)
+                    return self.posts[key]
+
+            if self.verbose: print("--> loading", key)
+            p = post(file, directory=directory, vars_index=vars_indices[vars], verbose=False)
+            p.processPOSTData(ranked=int(ranked), annual=bool(annual))
+            if building_file:
+                p.add_buildings(building_file, directory=directory)
+
+            with self.lock:
+                self.posts[key] = p
+                del self.loading[key]
+            self.evict()
+        return p
+
+    def datatype(self
+                ,p
+                ,key=None
+                ):
+        """datatype key from 'r_type|r_form|source_group', default the first datatype"""
+        if key is None:
+            return p.datatypes[0]
+        key = tuple(key.split("|"))
+        if key not in p.POSTdata:
+            raise KeyError("No datatype %s; available: %s" % (key, p.datatypes))
+        return key
+
+    def options(self
+               ,parameters
+               ):
+        """gridplot kwargs from request parameters; colorslevels is a support.color_dicts key"""
+        options = {name: parsevalue(value) for name, value in parameters.items()
+                   if name not in ("file", "directory", "vars", "ranked", "building_file", "key")}
+        if "colorslevels" in options:
+            options["colorslevels"] = color_dicts[options["colorslevels"]]
+        options.setdefault("pollutant", "PM2.5")
+        return options
+
+    def query(self
+             ,parameters
+             ):
+        """maximum of one datatype, with its location and event date"""
+        p = self.load(**parameters)
+        key = self.datatype(p, parameters.get("key"))
+        options = self.options(parameters)
+        receptors, concs = p.plotdata(*key, **options)
+        r = int(concs.argmax())
+        result = {"datatype" : list(key)
+                 ,"max"      : float(concs[r])
+                 ,"X"        : float(receptors.X[r])
+                 ,"Y"        : float(receptors.Y[r])
+                 ,"receptors": int(receptors.num)
+                 }
+        if (key in p.POSTevents) and not options.get("annual", False):
+            rank = options.get("ranked_data", 0)
+            events = p.eventdatetimes(*key)[:,0 if rank == 0 else rank-1]
+            if options.get("exclude_flagpole_receptors", False):
+                events = events[p.receptors.Z==0]
+            result["datetime"] = None if events[r] is None else events[r].isoformat()
+        return result
+
+    def field(self
+             ,parameters
+             ):
+        """concentrations at every receptor of one datatype"""
+        p = self.load(**parameters)
+        key = self.datatype(p, parameters.get("key"))
+        receptors, concs = p.plotdata(*key, **self.options(parameters))
+        return {"datatype" : list(key)
+               ,"X"        : receptors.X.tolist()
+               ,"Y"        : receptors.Y.tolist()
+               ,"conc"     : concs.tolist()
+               }
+
+    def grid(self
+            ,parameters
+            ):
+        """interpolated grid of one datatype as .npy bytes: rows of yi, columns of xi"""
+        p = self.load(**parameters)
+        key = self.datatype(p, parameters.get("key"))
+        options = self.options(parameters)
+        receptors, concs = p.plotdata(*key, **options)
+        xi, yi, zi = p.interpolate(receptors, concs, options.get("interpolation_method", "linear"))
+        buffer = io.BytesIO()
+        numpy.save(buffer, zi.filled(numpy.nan))
+        self.evict()
+        return buffer.getvalue()
+
+    def render(self
+              ,parameters
+              ):
+        """gridplot of one datatype as PNG bytes"""
+        import matplotlib
+        matplotlib.use("Agg")
+
+        p = self.load(**parameters)
+        key = self.datatype(p, parameters.get("key"))
+        options = self.options(parameters)
+        buffer = io.BytesIO()
+        options["filename"] = buffer
+        with self.render_lock:
+            p.gridplot(*key, **options)
+        self.evict()
+        return buffer.getvalue()
+
+    def status(self):
+        with self.lock:
+            return {"files"         : [list(key) for key in self.posts]
+                   ,"memory_in_use" : self.memory_in_use()
+                   ,"memory_cap"    : self.memory_cap
+                   }
+
+class requesthandler(http.server.BaseHTTPRequestHandler):
+    "HTTP GET front end for a resultserver"
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        parameters = dict(urllib.parse.parse_qsl(url.query))
+        results = self.server.results
+        try:
+            if url.path == "/status":
+                self.reply(json.dumps(results.status()))
+            elif url.path == "/load":
+                p = results.load(**parameters)
+                self.reply(json.dumps({"datatypes": [list(key) for key in p.datatypes]
+                                      ,"receptors": int(p.receptors.num)
+                                      ,"hours"    : len(p.datetimes)
+                                      }))
+            elif url.path == "/query":
+                self.reply(json.dumps(results.query(parameters)))
+            elif url.path == "/field":
+                self.reply(json.dumps(results.field(parameters)))
+            elif url.path == "/grid":
+                self.reply(results.grid(parameters), "application/octet-stream")
+            elif url.path == "/render":
+                self.reply(results.render(parameters), "image/png")
+            else:
+                self.send_error(404, "Unknown request %s" % url.path)
+        except (KeyError, TypeError, ValueError, IOError) as e:
+            self.send_error(400, str(e))
+
+    def reply(self
+             ,body
+             ,content_type="application/json"
+             ):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # UNIX socket clients have no (host, port) address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.results.verbose:
+            super().log_message(format, *args)
+
+class httpserver(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class unixserver(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(address=("127.0.0.1", 8765)
+         ,**kwargs
+         ):
+    """run a result server until interrupted
+
+    address - (host, port) for HTTP over TCP, or a filesystem path for a UNIX socket
+    kwargs  - resultserver arguments (memory_cap, directory, verbose)
+    """
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.remove(address)
+        server = unixserver(address, requesthandler)
+    else:
+        server = httpserver(address, requesthandler)
+    server.results = resultserver(**kwargs)
+    if server.results.verbose: print("--> serving results on", address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+
+    import sys
+
+    serve(directory=sys.argv[1] if len(sys.argv) > 1 else ".")
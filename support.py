@@ -190,6 +190,24 @@ pollutant_dict = {"PM2.5" : (r'$\mathregular{PM_{2.5}}$', r'$\mu\mathregular{g/m
                  ,"SO2"   : (r'$\mathregular{SO_{2}}$', "ppb")
                  }
 
+# AERMOD season index for each month (January first): 0 winter, 1 spring, 2 summer, 3 fall
+seasons = (0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0)
+
+# profile dimensions: number of buckets, and the bucket of an hour from its datetime
+profile_dimensions = {"season"    : (4,  lambda dt: seasons[dt.month-1])
+                     ,"month"     : (12, lambda dt: dt.month-1)
+                     ,"hour"      : (24, lambda dt: dt.hour)
+                     ,"dayofweek" : (7,  lambda dt: dt.weekday())
+                     }
+
+# compressed file extensions and the module providing open() for each
+compressors = {".gz"   : "gzip"
+              ,".bz2"  : "bz2"
+              ,".xz"   : "lzma"
+              ,".lzma" : "lzma"
+              ,".zst"  : "zstandard" # optional dependency
+              }
+
 vars_indices = {
     
     "post" : 
@@ -218,6 +236,11 @@ vars_indices = {
            ,"group": {"start": 78, "end": 87, "type": str  }
            ,"n_yrs": {"start": 88, "end": 97, "type": int  }
            ,"netid": {"start": 98, "end":107, "type": str  }
+           # repeated (AVER CONC YRn, DATE YRn) groups; positions within each group
+           ,"years": {"start":109, "width": 25
+                     ,"conc" : {"start":  0, "end": 13, "type": float}
+                     ,"date" : {"start": 15, "end": 23, "type": int  }
+                     }
            }
 
                }
@@ -0,0 +1,40 @@
+"""tests of the NO2 conversions in aermodpy.aermod"""
+
+import datetime
+import numpy
+
+from aermodpy.aermod import arm2, olm, background
+
+hours = [datetime.datetime(2010, 1, 1, hour) for hour in range(4)]
+nox = numpy.array([10.0, 100.0, 1000.0])
+
+def test_olm_hourly_ozone():
+    ozone = background([5.0, 20.0, 30.0, 40.0], form="HOURLY", datetimes=hours)
+    no2 = olm(ozone, isr=0.1)(nox, hours[0])
+    expected = 0.1 * nox + numpy.minimum(0.9 * nox, 1.881 * 5.0)
+    assert numpy.allclose(no2, expected)
+
+def test_olm_missing_ozone_hour_is_fully_converted():
+    ozone = background([5.0, 20.0], form="HOURLY", datetimes=hours[:2])
+    assert numpy.allclose(olm(ozone)(nox, hours[3]), nox)
+
+def test_olm_nan_ozone_is_fully_converted():
+    ozone = background([5.0, numpy.nan], form="HOURLY", datetimes=hours[:2])
+    assert numpy.allclose(olm(ozone)(nox, hours[1]), nox)
+
+def test_olm_explicit_missing_ozone_value_is_used():
+    ozone = background([5.0], form="HOURLY", datetimes=hours[:1], missing=0.0)
+    assert numpy.allclose(olm(ozone, isr=0.1)(nox, hours[3]), 0.1 * nox)
+
+def test_hourly_background_missing_defaults_to_zero():
+    assert background([5.0], form="HOURLY", datetimes=hours[:1])(hours[3]) == 0.0
+
+def test_arm2_ratio_limits():
+    no2 = arm2()(nox, hours[0])
+    ratios = no2 / nox
+    assert numpy.all((ratios >= 0.5) & (ratios <= 0.9))
+
+def test_arm2_unclipped_ratio():
+    # the ARM2 curve crosses 0.668 near 200 ug/m^3, between the limits
+    no2 = arm2()(numpy.array([200.0]), hours[0])
+    assert numpy.allclose(no2 / 200.0, 0.668, atol=0.001)
@@ -0,0 +1,29 @@
+"""tests of the column-wise csv formatting in aermodpy.aermod"""
+
+import numpy
+
+from aermodpy.aermod import fixedpoint
+
+def text(values, decimals):
+    columns = numpy.concatenate(fixedpoint(numpy.asarray(values), decimals))
+    return [bytes(column[column != 0]).decode("ascii") for column in columns.T]
+
+def test_fixedpoint_random_values():
+    values = numpy.random.default_rng(0).lognormal(0.0, 4.0, 10000) * numpy.where(numpy.arange(10000) % 3, 1, -1)
+    assert text(values, 5) == ["%.5f" % value for value in values.tolist()]
+
+def test_fixedpoint_ties():
+    values = numpy.array([27.359975, 0.000005, 0.000015, 1.000025, 2.5e-6, 12345.678905, 0.5, 1.5])
+    assert text(values, 5) == ["%.5f" % value for value in values.tolist()]
+
+def test_fixedpoint_negative_values_near_zero():
+    values = numpy.array([-0.000001, -0.000004, -0.0, -0.000005, -0.000006, 0.0])
+    assert text(values, 5) == ["%.5f" % value for value in values.tolist()]
+
+def test_fixedpoint_large_values():
+    values = numpy.array([29277957620230.707, 2**53 / 1e5 - 1, -9.5e13 / 1e1, 123456789.123455])
+    assert text(values, 5) == ["%.5f" % value for value in values.tolist()]
+
+def test_fixedpoint_integers():
+    values = numpy.array([0, -1, 7, 2011011503, -2**40, 10**15], dtype=numpy.int64)
+    assert text(values, 0) == ["%d" % value for value in values.tolist()]
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""asyncio supervisor for concurrent AERMOD run directories.
+
+Watches a set of directories for new or changed POST/GRF files and schedules
+parsing and rendering jobs onto a bounded worker pool. A file is processed once
+its size and modification time have been stable for `settle` seconds, and is
+not processed again until it changes.
+
+Directory events come from the optional `watchdog` package when it is
+installed, so an idle supervisor does no work; otherwise the directories are
+checked with os.scandir every `interval` seconds.
+
+developed for python 3.x
+"""
+
+# standard library imports
+import os.path
+import time
+import asyncio
+import threading
+import functools
+import concurrent.futures
+
+# internal package imports
+from aermodpy.aermod import post
+from aermodpy.support import vars_indices
+
+# file extensions recognized by the watcher, and their vars_indices entry
+filetypes = {".POS" : "post"
+            ,".PST" : "post"
+            ,".POST": "post"
+            ,".GRF" : "grf"
+            ,".PLT" : "grf"
+            }
+
+# pyplot is not thread safe: figures of a thread pool executor are rendered one at a time
+render_lock = threading.Lock()
+
+def process(filepath
+           ,vars="post"
+           ,ranked=1
+           ,annual=False
+           ,outdir=None
+           ,building_file=None
+           ,**options
+           ):
+    """parse one POST/GRF file and render a gridplot for each datatype
+
+    runs in a worker process, or a worker thread with rendering serialized by
+    render_lock. returns a summary of the parsed data and the
+    figures written.
+    """
+    directory, filename = os.path.split(filepath)
+    p = post(filename
+            ,directory=directory or "."
+            ,vars_index=vars_indices[vars]
+            ,verbose=False
+            )
+    p.processPOSTData(ranked=ranked, annual=annual)
+
+    figures = []
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+        if building_file and os.path.exists(os.path.join(directory, building_file)):
+            p.add_buildings(building_file, directory=directory)
+        for r_type, r_form, source_group in p.datatypes:
+            figure = os.path.join(outdir
+                                 ,os.path.splitext(filename)[0] + "_" + \
+                                  ("_".join([r_type, r_form, source_group])).replace(" ", "_") + ".png"
+                                 )
+            with render_lock:
+                p.gridplot(r_type
+                          ,r_form
+                          ,source_group
+                          ,annual=annual
+                          ,filename=figure
+                          ,**options
+                          )
+            figures.append(figure)
+
+    summary = p.progress()
+    summary["figures"] = figures
+    return summary
+
+class watcher:
+    "supervisor for AERMOD output directories"
+
+    verbose = False
+
+    def __init__(self
+                ,directories
+                ,workers=4
+                ,settle=2.0
+                ,interval=5.0
+                ,ranked=1
+                ,annual=False
+                ,outdir=None
+                ,building_file=None
+                ,executor=None
+                ,verbose=True
+                ,**options
+                ):
+        """
+        mandatory arguments:
+        directories - list of AERMOD run directories to watch
+
+        optional arguments:
+        workers  - size of the worker pool. default = 4
+        settle   - seconds a file must be unchanged before it is processed. default = 2.0
+        interval - seconds between directory checks when watchdog is not installed. default = 5.0
+        ranked   - number of ranked values passed to processPOSTData. default = 1
+        annual   - annual flag passed to processPOSTData and gridplot. default = False
+        outdir   - directory for rendered figures. figures are omitted if None
+        building_file - building/source file (.PIP) looked up in each run directory
+        executor - concurrent.futures executor. default = ProcessPoolExecutor(workers).
+                   a ThreadPoolExecutor also works, but renders one figure at a time
+        options  - keyword arguments passed to gridplot
+        """
+        self.directories = list(directories)
+        self.workers = workers
+        self.settle = settle
+        self.interval = interval
+        self.ranked = ranked
+        self.annual = annual
+        self.outdir = outdir
+        self.building_file = building_file
+        self.executor = executor
+        self.verbose = verbose
+        self.options = options
+
+        self.seen    = {} # path: ((size, mtime), time first seen with that signature)
+        self.done    = {} # path: signature of the last processed version
+        self.running = {} # path: signature being processed
+        self.results = {} # path: summary returned by process(), or {"error": message} if it failed
+        self._stopped = False
+        self._wake = None
+
+    def filetype(self
+                ,filename
+                ):
+        """vars_indices key for a watched filename, None if not watched"""
+        return filetypes.get(os.path.splitext(filename)[1].upper(), None)
+
+    def scan(self):
+        """record the current signature of every watched file"""
+        now = time.monotonic()
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if (self.filetype(entry.name) is None) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if self.seen.get(entry.path, (None, None))[0] != signature:
+                    self.seen[entry.path] = (signature, now)
+
+    def ready(self):
+        """files that changed since their last processing and have settled"""
+        now = time.monotonic()
+        return [path for path, (signature, since) in self.seen.items()
+                if (self.done.get(path) != signature)
+                and (path not in self.running)
+                and (now - since >= self.settle)
+               ]
+
+    def unsettled(self):
+        """True while any changed file is still waiting to settle"""
+        return any((self.done.get(path) != signature) and (path not in self.running)
+                   for path, (signature, since) in self.seen.items())
+
+    def stop(self):
+        """ask a running supervisor to return once its current jobs finish"""
+        self._stopped = True
+        if self._wake is not None:
+            self._wake.set()
+
+    def _start_observer(self
+                       ,loop
+                       ):
+        """start a watchdog observer that wakes the event loop on file events"""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            if self.verbose: print("watchdog not installed; checking directories every", self.interval, "seconds")
+            return None
+
+        handler = FileSystemEventHandler()
+        handler.on_any_event = lambda event: loop.call_soon_threadsafe(self._wake.set)
+        observer = Observer()
+        for directory in self.directories:
+            observer.schedule(handler, directory, recursive=False)
+        observer.start()
+        return observer
+
+    async def _job(self
+                  ,loop
+                  ,pool
+                  ,path
+                  ):
+        signature = self.running[path]
+        if self.verbose: print("--> processing", path)
+        try:
+            self.results[path] = await loop.run_in_executor(pool
+                                                            ,functools.partial(process, **self.options)
+                                                            ,path
+                                                            ,self.filetype(path)
+                                                            ,self.ranked
+                                                            ,self.annual
+                                                            ,self.outdir
+                                                            ,self.building_file
+                                                            )
+            self.done[path] = signature
+        except OSError as e:
+            # environmental failures (output directory, permissions, disk) are
+            # retried once the file has settled again
+            self.results[path] = {"error": repr(e)}
+            self.seen[path] = (signature, time.monotonic())
+            if self.verbose: print("failed to process", path, ":", e, "- will retry")
+        except Exception as e:
+            # unchanged files that fail to parse or render are not processed again
+            self.results[path] = {"error": repr(e)}
+            self.done[path] = signature
+            if self.verbose: print("failed to process", path, ":", e)
+        finally:
+            del self.running[path]
+            self._wake.set()
+
+    async def run(self
+                 ,idle_timeout=None
+                 ):
+        """watch the directories until stop() is called
+
+        idle_timeout - also return once no job has run or been pending for this many seconds
+        """
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopped = False
+        observer = self._start_observer(loop)
+        pool = self.executor or concurrent.futures.ProcessPoolExecutor(self.workers)
+        tasks = set()
+        last_activity = time.monotonic()
+        try:
+            while not self._stopped:
+                self._wake.clear()
+                self.scan()
+                for path in self.ready():
+                    if len(self.running) >= self.workers:
+                        break
+                    # claimed before the job starts, so the worker limit counts it
+                    self.running[path] = self.seen[path][0]
+                    task = loop.create_task(self._job(loop, pool, path))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+                if self.running or self.unsettled():
+                    last_activity = time.monotonic()
+                elif (idle_timeout is not None) and (time.monotonic() - last_activity >= idle_timeout):
+                    break
+
+                # sleep until a file event, a finished job, or the next settle check
+                if self.unsettled():
+                    timeout = self.settle
+                elif observer is None:
+                    timeout = self.interval
+                else:
+                    timeout = idle_timeout
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            if self.executor is None:
+                pool.shutdown()
+        return self.results
+
+if __name__ == "__main__":
+
+    import sys
+
+    supervisor = watcher(sys.argv[1:] or ["."]
+                        ,outdir="out"
+                        ,pollutant="NO2"
+                        )
+    asyncio.run(supervisor.run())